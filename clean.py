@@ -2,29 +2,116 @@ import pdfplumber
 import requests
 import json
 import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# MuPDF's native layout engine extracts text 10-50x faster than
+# pdfplumber's pure-Python one; fall back to pdfplumber if missing
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Dict
 import os
 
+# Pages handed to each extraction worker; amortizes the cost of
+# reopening the PDF in the child process
+PAGE_BATCH_SIZE = 10
+
+# Precompiled patterns for the per-page/per-sentence hot loops
+_RE_SINGLE_NL = re.compile(r'\n(?!\n)')
+_RE_WS = re.compile(r'\s+')
+_RE_SENT = re.compile(r'(?<=[.!?])\s+')
+# One alternation covering all clean_script fixes, so the script is
+# scanned once instead of once per pattern
+_RE_CLEANUP = re.compile(r'(```.*?```|`.*?`)|(\n{3,})|([A-Za-z]+):', re.DOTALL)
+
+def _json_dumps(obj):
+    """Serialize with orjson when available (returns bytes)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj)
+
+def _json_loads(data):
+    """Deserialize with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _extract_page_batch(pdf_path: str, page_indices: List[int]) -> List[str]:
+    """Extract and clean a batch of pages in a worker process.
+
+    PDF handles are not picklable, so each worker reopens the PDF and
+    pulls only its assigned pages.
+    """
+    if pymupdf is not None:
+        with pymupdf.open(pdf_path) as doc:
+            raw_pages = [doc[i].get_text("text") for i in page_indices]
+    else:
+        # extract_words skips the graphics (lines/curves/rects) parsing
+        # that extract_text pays for even on text-only pages
+        with pdfplumber.open(pdf_path) as pdf:
+            raw_pages = []
+            for i in page_indices:
+                page = pdf.pages[i]
+                words = page.extract_words(x_tolerance=2, y_tolerance=2,
+                                           keep_blank_chars=False)
+                raw_pages.append(" ".join(w["text"] for w in words))
+                page.flush_cache()
+
+    texts = []
+    for page_text in raw_pages:
+        page_text = _RE_SINGLE_NL.sub(' ', page_text)
+        page_text = _RE_WS.sub(' ', page_text)
+        texts.append(page_text)
+    return texts
+
 class PDFToScript:
-    def __init__(self):
+    def __init__(self, num_ctx: int = 4096, max_workers: int = 8):
         self.url = "http://localhost:11434/api/generate"
         self.headers = {
             "Content-Type": "application/json"
         }
+        # Reuse one session so concurrent chunk requests share pooled
+        # keep-alive connections instead of reconnecting per chunk;
+        # size the pool past max_workers so threads never wait on a socket
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=requests.adapters.Retry(total=3, backoff_factor=0.2)
+        )
+        self.session.mount("http://", adapter)
+        self.num_ctx = num_ctx
+        self.max_workers = max_workers
 
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF file."""
+    def extract_text_from_pdf(self, pdf_path: str, workers: int = None) -> str:
+        """Extract text from PDF file, parallelized across pages."""
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    # Extract text with better formatting preservation
-                    page_text = page.extract_text(x_tolerance=2, y_tolerance=2)
-                    # Clean up the text
-                    page_text = re.sub(r'\n(?!\n)', ' ', page_text)
-                    page_text = re.sub(r'\s+', ' ', page_text)
-                    text += page_text + "\n\n"
-                return text.strip()
+            if pymupdf is not None:
+                with pymupdf.open(pdf_path) as doc:
+                    num_pages = doc.page_count
+            else:
+                with pdfplumber.open(pdf_path) as pdf:
+                    num_pages = len(pdf.pages)
+
+            # Page extraction is CPU-bound layout analysis, so spread
+            # batches of pages across worker processes
+            batches = [list(range(start, min(start + PAGE_BATCH_SIZE, num_pages)))
+                       for start in range(0, num_pages, PAGE_BATCH_SIZE)]
+            workers = workers or os.cpu_count()
+
+            page_texts = []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for batch_texts in executor.map(
+                        _extract_page_batch, [pdf_path] * len(batches), batches):
+                    page_texts.extend(batch_texts)
+
+            return "\n\n".join(page_texts).strip()
         except Exception as e:
             print(f"Error extracting PDF: {str(e)}")
             return ""
@@ -32,21 +119,26 @@ class PDFToScript:
     def chunk_text(self, text: str, chunk_size: int = 1000) -> List[str]:
         """Split text into smaller chunks for processing."""
         # Split on sentences to avoid cutting in middle of dialogue
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        sentences = _RE_SENT.split(text)
         chunks = []
-        current_chunk = ""
+        # Accumulate sentences in a list and join on flush; repeated
+        # string += would be quadratic in total text length
+        buf = []
+        buf_len = 0
 
         for sentence in sentences:
-            if len(current_chunk) + len(sentence) < chunk_size:
-                current_chunk += sentence + " "
+            if buf_len + len(sentence) < chunk_size:
+                buf.append(sentence)
+                buf_len += len(sentence) + 1
             else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + " "
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-            
+                if buf:
+                    chunks.append(" ".join(buf))
+                buf = [sentence]
+                buf_len = len(sentence) + 1
+
+        if buf:
+            chunks.append(" ".join(buf))
+
         return chunks
 
     def process_chunk(self, chunk: str) -> str:
@@ -72,42 +164,53 @@ class PDFToScript:
         data = {
             "model": "llama3.2",
             "prompt": prompt,
-            "stream": False
+            "stream": True,
+            "options": {"num_ctx": self.num_ctx},
+            # Keep the model loaded between concurrent requests
+            "keep_alive": "10m"
         }
 
         try:
-            response = requests.post(
-                self.url, 
-                headers=self.headers, 
-                data=json.dumps(data)
+            response = self.session.post(
+                self.url,
+                headers=self.headers,
+                data=_json_dumps(data),
+                stream=True,
+                timeout=(5, 300)
             )
-            
-            if response.status_code == 200:
-                response_data = json.loads(response.text)
-                return response_data["response"].strip()
-            else:
+
+            if response.status_code != 200:
                 print(f"Error: Response status code {response.status_code}")
                 return ""
+
+            # Consume the NDJSON stream as tokens arrive instead of
+            # buffering the whole generation in one body
+            parts = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                payload = _json_loads(line)
+                parts.append(payload.get("response", ""))
+                if payload.get("done"):
+                    break
+            response.close()
+            return "".join(parts).strip()
         except Exception as e:
             print(f"Error processing chunk: {str(e)}")
             return ""
 
     def clean_script(self, script: str) -> str:
         """Clean and format the generated script."""
-        # Remove any markdown or code block markers
-        script = re.sub(r'```.*?```', '', script, flags=re.DOTALL)
-        script = re.sub(r'`.*?`', '', script)
-        
-        # Ensure consistent formatting
-        script = re.sub(r'\n{3,}', '\n\n', script)
-        
-        # Ensure speaker names are in caps
-        def capitalize_speaker(match):
-            return match.group(1).upper() + match.group(2)
-        
-        script = re.sub(r'([A-Za-z]+)(:)', capitalize_speaker, script)
-        
-        return script.strip()
+        # Single pass: strip markdown/code markers, collapse extra
+        # blank lines, and uppercase speaker names
+        def cleanup(match):
+            if match.group(1):
+                return ''
+            if match.group(2):
+                return '\n\n'
+            return match.group(3).upper() + ':'
+
+        return _RE_CLEANUP.sub(cleanup, script).strip()
 
     def generate_script(self, pdf_path: str, output_path: str) -> None:
         """Generate a complete drama script from PDF and save to file."""
@@ -119,17 +222,6 @@ class PDFToScript:
 
         print("Converting to script format...")
         chunks = self.chunk_text(text)
-        full_script = []
-        
-        for i, chunk in enumerate(chunks, 1):
-            print(f"Processing chunk {i}/{len(chunks)}...")
-            script_chunk = self.process_chunk(chunk)
-            if script_chunk:
-                full_script.append(script_chunk)
-
-        # Combine and clean the full script
-        final_script = "\n\n".join(full_script)
-        final_script = self.clean_script(final_script)
 
         # Add header to the script
         header = f"""DRAMA SCRIPT
@@ -137,12 +229,25 @@ Generated from: {os.path.basename(pdf_path)}
 Date: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 """
-        final_script = header + final_script
 
-        # Save to file
+        # Pipeline the LLM and disk stages: chunks stream through the
+        # worker pool concurrently while map() yields them in order, and
+        # each finished chunk is cleaned and appended to the file right
+        # away, so writing overlaps generation and the full script is
+        # never held in memory
+        print(f"Processing {len(chunks)} chunks with {self.max_workers} workers...")
         try:
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(final_script)
+                f.write(header)
+                first = True
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    for script_chunk in executor.map(self.process_chunk, chunks):
+                        if not script_chunk:
+                            continue
+                        if not first:
+                            f.write("\n\n")
+                        f.write(self.clean_script(script_chunk))
+                        first = False
             print(f"\nScript successfully generated and saved to: {output_path}")
         except Exception as e:
             print(f"Error saving script: {str(e)}")
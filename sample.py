@@ -1,66 +1,132 @@
+import logging
 import os
 import torch
 import re
+import numpy as np
+import librosa
 import spacy
 from TTS.api import TTS
 from pydub import AudioSegment
 import pdfplumber
 import warnings
 
+# MuPDF's native layout engine extracts text 10-50x faster than
+# pdfplumber's pure-Python one; fall back to pdfplumber if missing
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
 warnings.filterwarnings("ignore", category=UserWarning)  # Suppress TTS warnings
 
-# Load spaCy transformer model (this may take a moment)
-nlp = spacy.load("en_core_web_trf")
+logger = logging.getLogger(__name__)
+
+# Small pipeline is plenty here: we only need dependency parsing to
+# find the subject of a speech verb, so skip NER and lemmatization
+nlp = spacy.load("en_core_web_sm", disable=["ner", "lemmatizer", "attribute_ruler"])
+
+# All inflections of the speech verbs, so we can match on surface
+# forms without the lemmatizer
+SPEECH_VERB_FORMS = {"say", "says", "said", "saying",
+                     "exclaim", "exclaims", "exclaimed", "exclaiming",
+                     "shout", "shouts", "shouted", "shouting",
+                     "whisper", "whispers", "whispered", "whispering",
+                     "scream", "screams", "screamed", "screaming",
+                     "yell", "yells", "yelled", "yelling",
+                     "ask", "asks", "asked", "asking",
+                     "reply", "replies", "replied", "replying"}
+
+# Precompiled patterns for the per-page/per-sentence hot loops
+# Single-character replacements go through str.translate (tight C
+# loop) rather than the regex engine
+_QUOTE_TABLE = str.maketrans({"‘": '"', "’": '"',
+                              "“": '"', "”": '"'})
+_RE_PUNCT_SPACE = re.compile(r'\s+([.,!?])')
+_RE_NEWLINES = re.compile(r'\n+')
+_RE_QUOTED = re.compile(r'["\'](.*?)["\']')
+_RE_SENT = re.compile(r'(?<=[.!?])\s+')
+_RE_TRAILING_PUNCT = re.compile(r'[.!?]+$')
 
 class BookToSpeech:
     def __init__(self, speed=1.0):
         self.speed = speed
         self.model_name = "tts_models/en/vctk/vits"
         self.tts = TTS(self.model_name).to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+        if torch.cuda.is_available():
+            model = self.tts.synthesizer.tts_model
+            # Halve weight/activation bandwidth; bf16 on Ampere+ for
+            # numerical stability, fp16 on older cards
+            if torch.cuda.is_bf16_supported():
+                model.to(torch.bfloat16)
+            else:
+                model.half()
+            # reduce-overhead mode captures CUDA graphs, removing
+            # per-sentence Python and kernel-launch overhead
+            model.forward = torch.compile(model.forward, mode="reduce-overhead",
+                                          fullgraph=False)
+            # Warmup so graph capture happens before the real loop
+            self.tts.tts(text="Warming up.", speaker="p225")
         self.available_voices = ["p225", "p226", "p227", "p228", "p229",
                                  "p230", "p231", "p232", "p233", "p234"]
         self.character_voices = {"narrator": "p225"}
         self.next_voice_index = 1
+        # Dialogue tags ("he said", "she replied") repeat constantly,
+        # so cache detection results per normalized sentence
+        self._speaker_cache = {}
+        # Reusable silences, generated once at the synthesizer's output
+        # rate so splicing them never triggers a resample
+        sample_rate = self.tts.synthesizer.output_sample_rate
+        self._silence_100 = AudioSegment.silent(duration=100, frame_rate=sample_rate)
+        self._silence_200 = AudioSegment.silent(duration=200, frame_rate=sample_rate)
         os.makedirs("output_audio", exist_ok=True)
 
     # Extract text from only the first 3 pages of the PDF
     def extract_text_from_pdf(self, pdf_path):
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                full_text = []
-                for page in pdf.pages[:3]:
-                    text = page.extract_text(x_tolerance=2, y_tolerance=2)
-                    # Convert smart quotes to standard quotes and fix punctuation spacing
-                    text = re.sub(r"‘|’", '"', text)
-                    text = re.sub(r'\s+([.,!?])', r'\1', text)
-                    # Replace newlines with a space so dialogue isn't broken
-                    text = re.sub(r'\n+', ' ', text)
-                    full_text.append(text)
-                return " ".join(full_text)
+            if pymupdf is not None:
+                with pymupdf.open(pdf_path) as doc:
+                    page_texts = [doc[i].get_text("text")
+                                  for i in range(min(3, doc.page_count))]
+            else:
+                # extract_words skips the graphics parsing that
+                # extract_text pays for even on text-only pages
+                with pdfplumber.open(pdf_path) as pdf:
+                    page_texts = []
+                    for page in pdf.pages[:3]:
+                        words = page.extract_words(x_tolerance=2, y_tolerance=2,
+                                                   keep_blank_chars=False)
+                        page_texts.append(" ".join(w["text"] for w in words))
+                        page.flush_cache()
+
+            full_text = []
+            for text in page_texts:
+                # Convert smart quotes to standard quotes and fix punctuation spacing
+                text = text.translate(_QUOTE_TABLE)
+                text = _RE_PUNCT_SPACE.sub(r'\1', text)
+                # Replace newlines with a space so dialogue isn't broken
+                text = _RE_NEWLINES.sub(' ', text)
+                full_text.append(text)
+            return " ".join(full_text)
         except Exception as e:
             print(f"PDF Extraction Error: {str(e)}")
             return None
 
-    # ML-based speaker detection using spaCy dependency parsing and NER
-    def detect_speaker_ml(self, sentence):
-        # Process the sentence with spaCy
-        doc = nlp(sentence)
+    # ML-based speaker detection using spaCy dependency parsing
+    def detect_speaker_ml(self, sentence, doc=None):
+        # Process the sentence with spaCy unless a doc was pre-parsed
+        if doc is None:
+            doc = nlp(sentence)
         dialogue = None
 
         # First, extract dialogue text if it's enclosed in quotes
-        quote_matches = re.findall(r'["\'](.*?)["\']', sentence)
+        quote_matches = _RE_QUOTED.findall(sentence)
         if quote_matches:
             dialogue = quote_matches[0].strip()
 
-        # Define a set of common speech verbs
-        speech_verbs = {"say", "said", "exclaim", "exclaimed", "shout", "shouted",
-                        "whisper", "whispered", "scream", "screamed", "yell", "yelled",
-                        "ask", "asked", "reply", "replied"}
-
         speaker = None
         # Look through tokens for a speech verb; then check its subject
         for token in doc:
-            if token.lemma_.lower() in speech_verbs:
+            if token.text.lower() in SPEECH_VERB_FORMS:
                 for child in token.children:
                     if child.dep_ in ["nsubj", "nsubjpass"]:
                         speaker = child.text
@@ -79,64 +145,117 @@ class BookToSpeech:
             dialogue = sentence
         return speaker, f'"{dialogue}"'
 
+    # Cached speaker detection; the trailing punctuation is stripped
+    # from the key so "he said." and "he said!" share an entry
+    def _speaker_for(self, sentence, doc=None):
+        key = _RE_TRAILING_PUNCT.sub('', sentence)
+        cached = self._speaker_cache.get(key)
+        if cached is None:
+            cached = self.detect_speaker_ml(sentence, doc)
+            self._speaker_cache[key] = cached
+        return cached
+
     # Use the ML-based approach for speaker detection
     def detect_speaker(self, current_index, sentences):
         sentence = sentences[current_index].strip()
-        return self.detect_speaker_ml(sentence)
+        return self._speaker_for(sentence)
 
-    # Generate audio by processing text sentence-by-sentence
+    # Convert a raw TTS waveform (list of floats) into an AudioSegment
+    def waveform_to_segment(self, wav):
+        wav = np.asarray(wav, dtype=np.float32)
+        if self.speed != 1.0:
+            # Stretch on the waveform itself; unlike the pydub
+            # frame-rate respawn trick this keeps the pitch intact
+            wav = librosa.effects.time_stretch(wav, rate=self.speed)
+        pcm = np.clip(wav * 32767, -32768, 32767).astype(np.int16)
+        return AudioSegment(
+            data=pcm.tobytes(),
+            sample_width=2,
+            frame_rate=self.tts.synthesizer.output_sample_rate,
+            channels=1
+        )
+
+    # Generate audio by batching sentences per voice
     def generate_audio(self, text, output_filename="output.wav"):
         # Split text into sentences (this basic split may need refinement)
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        output_audio = AudioSegment.silent(duration=100)
-        temp_files = []
+        sentences = _RE_SENT.split(text)
 
         try:
-            for idx, sentence in enumerate(sentences):
-                sentence = sentence.strip()
-                if not sentence:
-                    continue
+            # First pass: parse all sentences in one spaCy batch, then
+            # resolve each sentence's voice so all lines sharing a
+            # voice can go to the model in one batched call
+            stripped = [(idx, s.strip()) for idx, s in enumerate(sentences) if s.strip()]
+
+            # Only cache misses go through spaCy; repeated dialogue
+            # tags skip parsing entirely
+            misses = []
+            seen = set()
+            for _, sentence in stripped:
+                key = _RE_TRAILING_PUNCT.sub('', sentence)
+                if key not in self._speaker_cache and key not in seen:
+                    seen.add(key)
+                    misses.append(sentence)
+            for sentence, doc in zip(misses, nlp.pipe(misses, batch_size=64)):
+                self._speaker_for(sentence, doc)
 
-                speaker, dialogue = self.detect_speaker(idx, sentences)
+            groups = {}
+            for idx, sentence in stripped:
+                speaker, dialogue = self._speaker_for(sentence)
                 voice = self.assign_voice(speaker)
-                temp_path = f"output_audio/temp_{idx}.wav"
-                print(f"Processing: {speaker} => {dialogue[:50]}...")
+                groups.setdefault(voice, []).append((idx, dialogue))
 
-                self.tts.tts_to_file(
-                    text=dialogue,
+            segments = {}
+            for voice, lines in groups.items():
+                print(f"Synthesizing {len(lines)} lines with voice {voice}...")
+                wavs = self.tts.tts(
+                    text=[dialogue for _, dialogue in lines],
                     speaker=voice,
-                    file_path=temp_path,
                     speed=self.speed
                 )
+                for (idx, _), wav in zip(lines, wavs):
+                    segments[idx] = self.waveform_to_segment(wav)
 
-                segment = AudioSegment.from_wav(temp_path)
-                if self.speed != 1.0:
-                    segment = segment._spawn(segment.raw_data, 
-                                               overrides={"frame_rate": int(segment.frame_rate * self.speed)}
-                                              ).set_frame_rate(segment.frame_rate)
+            # Reassemble in original sentence order with short pauses.
+            # AudioSegment addition recopies the whole buffer each time
+            # (quadratic in total length), so splice the raw PCM into
+            # one preallocated buffer and build a single segment
+            sample_rate = self.tts.synthesizer.output_sample_rate
+            lead_raw = self._silence_100.raw_data
+            pause_raw = self._silence_200.raw_data
+            ordered = [segments[idx].raw_data for idx in sorted(segments)]
 
-                output_audio += segment + AudioSegment.silent(duration=200)
-                temp_files.append(temp_path)
+            buf = bytearray(len(lead_raw) + sum(len(raw) + len(pause_raw) for raw in ordered))
+            buf[:len(lead_raw)] = lead_raw
+            offset = len(lead_raw)
+            for raw in ordered:
+                buf[offset:offset + len(raw)] = raw
+                offset += len(raw)
+                buf[offset:offset + len(pause_raw)] = pause_raw
+                offset += len(pause_raw)
 
+            output_audio = AudioSegment(
+                data=bytes(buf),
+                sample_width=2,
+                frame_rate=sample_rate,
+                channels=1
+            )
             output_audio.export(f"output_audio/{output_filename}", format="wav")
             print(f"Successfully generated: output_audio/{output_filename}")
         except Exception as e:
             print(f"Generation Error: {str(e)}")
-        finally:
-            for f in temp_files:
-                if os.path.exists(f):
-                    os.remove(f)
 
     # Assign voices to speakers; new speakers get the next available voice.
     def assign_voice(self, character):
-        if character not in self.character_voices:
-            try:
-                self.character_voices[character] = self.available_voices[self.next_voice_index]
-                self.next_voice_index = (self.next_voice_index + 1) % len(self.available_voices)
-                print(f"Assigned {self.character_voices[character]} to {character}")
-            except IndexError:
-                self.character_voices[character] = "p225"
-        return self.character_voices[character]
+        voice = self.character_voices.get(character)
+        if voice is not None:
+            return voice
+        # next_voice_index wraps modulo the voice list, so the index
+        # can never be out of range
+        voice = self.available_voices[self.next_voice_index]
+        self.next_voice_index = (self.next_voice_index + 1) % len(self.available_voices)
+        self.character_voices[character] = voice
+        logger.debug("Assigned %s to %s", voice, character)
+        return voice
 
 # Usage example:
 if __name__ == "__main__":